@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+# Compare the fast parser of rss.py with feedparser on large feeds
+# usage: python benchmark_rss.py [items] [rounds]
+from __future__ import print_function
+from sopel.modules import rss
+import io
+import sys
+import timeit
+
+ITEM = '''<item>
+<title>Title {0}</title>
+<link>http://www.site1.com/article{0}?id={0}&amp;ref=rss</link>
+<description>Description of article {0}. {1}</description>
+<author>Author {0}</author>
+<category>Category</category>
+<pubDate>Sat, 23 Aug 2016 03:30:33 +0000</pubDate>
+<guid isPermaLink="false">{0} at http://www.site1.com/</guid>
+</item>
+'''
+
+FEED = '''<?xml version="1.0" encoding="utf-8" ?>
+<rss version="2.0">
+<channel>
+<title>Site 1 Articles</title>
+<link>http://www.site1.com/feed</link>
+<description>Benchmark</description>
+<ttl>60</ttl>
+{}</channel>
+</rss>'''
+
+HEADERS = {
+    'content-location': 'http://www.site1.com/feed',
+    'content-type': 'application/rss+xml; charset=utf-8',
+}
+
+
+def feed(items):
+    text = 'Lorem ipsum dolor sit amet, consectetur adipiscing elit. ' * 10
+    return FEED.format(''.join(ITEM.format(i, text) for i in range(items))).encode('utf-8')
+
+
+def main(items=500, rounds=10):
+    body = feed(items)
+    assert rss.FastFeedParser(dict(HEADERS)).parse(body) is not None
+
+    slow = timeit.timeit(lambda: rss.feedparser.parse(io.BytesIO(body), response_headers=dict(HEADERS)), number=rounds) / rounds
+    fast = timeit.timeit(lambda: rss._feed_parse(body, dict(HEADERS)), number=rounds) / rounds
+
+    print('{} items, {} kB'.format(items, len(body) // 1024))
+    print('feedparser: {:8.2f} ms'.format(slow * 1000))
+    print('fast:       {:8.2f} ms'.format(fast * 1000))
+    print('speedup:    {:8.1f}x'.format(slow / fast))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
@@ -3,10 +3,18 @@ from __future__ import unicode_literals
 from sopel.db import SopelDB
 from sopel.modules import rss
 from sopel.test_tools import MockSopel, MockConfig
+import calendar
+import gzip
 import hashlib
+import http.server
+import importlib.util
+import io
 import os
 import pytest
+import sys
 import tempfile
+import threading
+import time
 import types
 
 FEED_VALID = '''<?xml version="1.0" encoding="utf-8" ?>
@@ -121,11 +129,25 @@ FEED_SPY = '''<?xml version="1.0" encoding="UTF-8"?>
 </rss>
 '''
 
+# Implementing a mock shortener which creates short urls locally
+class MockShortener:
+    def __init__(self, timeout=rss.SHORTURL_TIMEOUT):
+        self.timeout = timeout
+
+    def shorten(self, url):
+        return 'https://tinyurl.example.invalid/' + hashlib.md5(url.encode('utf-8')).hexdigest()[:7]
+
+    async def shorten_async(self, url, engine):
+        return self.shorten(url)
+
+
 def _fixture_bot_setup(request):
     bot = MockSopel('Sopel')
     bot = rss._config_define(bot)
     bot.config.core.db_filename = tempfile.mkstemp()[1]
     bot.db = SopelDB(bot.config)
+    rss._db_create_table(bot)
+    bot.memory['rss']['shorturls'] = rss.ShortUrlCache(bot, MockShortener())
     bot.output = ''
 
     # monkey patch bot
@@ -151,8 +173,6 @@ def _fixture_bot_add_data(bot, id, url):
     bot.memory['rss']['hashes']['feed'+id] = rss.RingBuffer(100)
     feedreader = rss.MockFeedReader(FEED_VALID)
     bot.memory['rss']['options']['feed'+id] = rss.Options(bot, feedreader)
-    sql_create_table = 'CREATE TABLE ' + rss._digest_tablename('feed'+id) + ' (id INTEGER PRIMARY KEY, hash VARCHAR(32) UNIQUE)'
-    bot.db.execute(sql_create_table)
     bot.config.core.channels = ['#channel' + id]
     return bot
 
@@ -192,6 +212,13 @@ def bot_rss_update(request):
     return bot
 
 
+@pytest.fixture(scope="function")
+def engine(request):
+    engine = rss.AsyncEngine()
+    request.addfinalizer(engine.shutdown)
+    return engine
+
+
 @pytest.fixture(scope="module")
 def feedreader_feed_valid():
     return rss.MockFeedReader(FEED_VALID)
@@ -329,6 +356,12 @@ def test_config_define_feeds():
     assert type(bot.memory['rss']['feeds']) == dict
 
 
+def test_config_define_feedreaders():
+    bot = MockSopel('Sopel')
+    bot = rss._config_define(bot)
+    assert type(bot.memory['rss']['feedreaders']) == dict
+
+
 def test_config_define_hashes():
     bot = MockSopel('Sopel')
     bot = rss._config_define(bot)
@@ -375,6 +408,16 @@ def test_config_read_feed_default(bot_basic):
     assert expected == feeds
 
 
+def test_config_read_feed_without_reading_it(bot_basic, monkeypatch):
+    requests = _fixture_urlopen(monkeypatch, FEED_VALID.encode('utf-8'))
+    bot_basic.config.rss.feeds = ['#channel;feed;http://www.site1.com/feed;f=fl+ftl;t=t|>>{}<<']
+    rss._config_read(bot_basic)
+    assert rss._feed_exists(bot_basic, 'feed')
+    assert 'f=fl+ftl' == bot_basic.memory['rss']['options']['feed'].get_format()
+    assert 't=t|>>{}<<' == bot_basic.memory['rss']['options']['feed'].get_templates()
+    assert [] == requests
+
+
 def test_config_read_format_default(bot_basic):
     bot_basic.config.rss.formats = ['f=' + rss.FORMAT_DEFAULT]
     rss._config_read(bot_basic)
@@ -592,52 +635,86 @@ def test_config_split_templates_invalid(bot):
     assert templates_split['t'] == '{}'
 
 
-def test_db_create_table_and_db_check_if_table_exists(bot):
-    rss._db_create_table(bot, 'feedname')
-    result = rss._db_check_if_table_exists(bot, 'feedname')
-    assert [(rss._digest_tablename('feedname'),)] == result
+def test_db_create_table(bot):
+    rss._db_create_table(bot)
+    sql_tables = "SELECT name FROM sqlite_master WHERE name LIKE 'rss%' ORDER BY name"
+    result = bot.db.execute(sql_tables).fetchall()
+    assert [('rss_feeds',), ('rss_hashes',), ('rss_hashes_feed_id_hash',), ('rss_shorturls',)] == result
+
 
+def test_db_migrate_tables(bot):
+    tablename = rss._digest_tablename('feed1')
+    bot.db.execute('CREATE TABLE ' + tablename + ' (id INTEGER PRIMARY KEY, hash VARCHAR(32) UNIQUE)')
+    bot.db.execute('INSERT INTO ' + tablename + ' VALUES (NULL, ?)', ('463f9357db6c20a94a68f9c9ef3bb0fb',))
+    bot.db.execute('INSERT INTO ' + tablename + ' VALUES (NULL, ?)', ('601daf484a5766ecff6f6d1dc19131dc',))
+    rss._db_migrate_tables(bot)
+    hashes = rss._db_read_hashes_from_database(bot, 'feed1')
+    assert [bytes.fromhex('463f9357db6c20a94a68f9c9ef3bb0fb'), bytes.fromhex('601daf484a5766ecff6f6d1dc19131dc')] == [hash[1] for hash in hashes]
+    sql_check_table = "SELECT name FROM sqlite_master WHERE type='table' AND name=(?)"
+    assert [] == bot.db.execute(sql_check_table, (tablename,)).fetchall()
 
-def test_db_drop_table(bot):
-    rss._db_create_table(bot, 'feedname')
-    rss._db_drop_table(bot, 'feedname')
-    result = rss._db_check_if_table_exists(bot, 'feedname')
-    assert [] == result
+
+def test_db_migrate_hashes(bot):
+    sql_save_hash = 'INSERT INTO rss_hashes (feed_id, hash, seen_at) VALUES (?, ?, 0)'
+    bot.db.execute(sql_save_hash, ('feed1', '463f9357db6c20a94a68f9c9ef3bb0fb'))
+    bot.db.execute(sql_save_hash, ('feed1', bytes.fromhex('601daf484a5766ecff6f6d1dc19131dc')))
+    bot.db.execute(sql_save_hash, ('feed1', '601daf484a5766ecff6f6d1dc19131dc'))
+    rss._db_migrate_hashes(bot)
+    hashes = rss._db_read_hashes_from_database(bot, 'feed1')
+    assert [bytes.fromhex('463f9357db6c20a94a68f9c9ef3bb0fb'), bytes.fromhex('601daf484a5766ecff6f6d1dc19131dc')] == [hash[1] for hash in hashes]
+
+
+def test_db_remove_hashes(bot):
+    rss._db_save_hashes_to_database(bot, {'feed1': [bytes.fromhex('463f9357db6c20a94a68f9c9ef3bb0fb')]})
+    rss._db_remove_hashes(bot, 'feed1')
+    assert 0 == rss._db_get_number_of_rows(bot, 'feed1')
 
 
 def test_config_templates_example(bot):
     example = rss._config_templates_example(bot)
-    expected = '<Author> Description \x02[Feedname]\x02 GUID \x02→\x02 https://github.com/RebelCodeBase/sopel-rss (2016-09-03 10:00) Description Title \x02→\x02 https://tinyurl.com/govvpmm'
+    expected = '<Author> Description \x02[Feedname]\x02 GUID \x02→\x02 https://github.com/RebelCodeBase/sopel-rss (2016-09-03 10:00) Description Title \x02→\x02 ' + MockShortener().shorten('https://github.com/RebelCodeBase/sopel-rss')
     assert expected == example
 
 
 def test_db_get_numer_of_rows(bot):
     ROWS = 10
     for i in range(ROWS):
-        hash = rss.hashlib.md5(str(i).encode('utf-8')).hexdigest()
+        hash = rss.hashlib.md5(str(i).encode('utf-8')).digest()
         bot.memory['rss']['hashes']['feed1'].append(hash)
-        rss._db_save_hash_to_database(bot, 'feed1', hash)
+    rss._db_save_hashes_to_database(bot, {'feed1': list(bot.memory['rss']['hashes']['feed1'])})
     rows_feed = rss._db_get_number_of_rows(bot, 'feed1')
     assert ROWS == rows_feed
 
 
-def test_db_remove_old_hashes_from_database(bot):
+def test_db_remove_old_hashes(bot):
     SURPLUS_ROWS = 10
-    bot.memory['rss']['hashes']['feed1'] = rss.RingBuffer(rss.MAX_HASHES_PER_FEED + SURPLUS_ROWS)
-    for i in range(rss.MAX_HASHES_PER_FEED + SURPLUS_ROWS):
-        hash = hashlib.md5(str(i).encode('utf-8')).hexdigest()
-        bot.memory['rss']['hashes']['feed1'].append(hash)
-        rss._db_save_hash_to_database(bot, 'feed1', hash)
-    rss._db_remove_old_hashes_from_database(bot, 'feed1')
-    rows_feed = rss._db_get_number_of_rows(bot, 'feed1')
-    assert rss.MAX_HASHES_PER_FEED == rows_feed
-
-
-def test_db_save_hash_to_database(bot):
-    rss._db_save_hash_to_database(bot, 'feed1', '463f9357db6c20a94a68f9c9ef3bb0fb')
-    hashes = rss._db_read_hashes_from_database(bot, 'feed1')
-    expected = [(1, '463f9357db6c20a94a68f9c9ef3bb0fb')]
-    assert expected == hashes
+    rss._feed_add(bot, '#channel', 'feed2', FEED_VALID)
+    hashes = dict()
+    for feedname in ['feed1', 'feed2']:
+        hashes[feedname] = list()
+        for i in range(rss.MAX_HASHES_PER_FEED + SURPLUS_ROWS):
+            hashes[feedname].append(hashlib.md5((feedname + str(i)).encode('utf-8')).digest())
+    rss._db_save_hashes_to_database(bot, hashes)
+    rss._db_remove_old_hashes(bot)
+    for feedname in ['feed1', 'feed2']:
+        assert rss.MAX_HASHES_PER_FEED == rss._db_get_number_of_rows(bot, feedname)
+        rows = rss._db_read_hashes_from_database(bot, feedname)
+        assert hashes[feedname][SURPLUS_ROWS:] == [row[1] for row in rows]
+
+
+def test_db_save_hashes_to_database(bot):
+    rss._feed_add(bot, '#channel', 'feed2', FEED_VALID)
+    hashes = {
+        'feed1': [bytes.fromhex('463f9357db6c20a94a68f9c9ef3bb0fb'), bytes.fromhex('601daf484a5766ecff6f6d1dc19131dc')],
+        'feed2': [bytes.fromhex('53c674b8916ad03755a6f8b679515b3a')],
+    }
+    rows, seconds = rss._db_save_hashes_to_database(bot, hashes)
+    assert 3 == rows
+    assert seconds >= 0
+    expected = [(1, bytes.fromhex('463f9357db6c20a94a68f9c9ef3bb0fb')), (2, bytes.fromhex('601daf484a5766ecff6f6d1dc19131dc'))]
+    assert expected == rss._db_read_hashes_from_database(bot, 'feed1')
+    rows, seconds = rss._db_save_hashes_to_database(bot, hashes)
+    assert 0 == rows
 
 
 def test_digest_tablename_works():
@@ -645,15 +722,15 @@ def test_digest_tablename_works():
     assert 'rss_f830f69d23b8224b512a0dc2f5aec974' == digest
 
 
-def test_feed_add_create_db_table(bot):
+def test_feed_add_defer_ring_buffer(bot):
     rss._feed_add(bot, '#channel', 'feedname', FEED_VALID)
-    result = rss._db_check_if_table_exists(bot, 'feedname')
-    assert [(rss._digest_tablename('feedname'),)] == result
+    assert 'feedname' not in bot.memory['rss']['hashes']
+    assert type(rss._hashes_get(bot, 'feedname')) == rss.RingBuffer
 
 
-def test_feed_add_create_ring_buffer(bot):
+def test_feed_add_create_feedreader(bot):
     rss._feed_add(bot, '#channel', 'feedname', FEED_VALID)
-    assert type(bot.memory['rss']['hashes']['feedname']) == rss.RingBuffer
+    assert type(bot.memory['rss']['feedreaders']['feedname']) == rss.FeedReader
 
 
 def test_feed_add_create_feed(bot):
@@ -691,11 +768,11 @@ def test_feed_check_feed_item_must_have_title_or_description(bot, feedreader_fee
     assert expected == checkresults
 
 
-def test_feed_delete_delete_db_table(bot):
+def test_feed_delete_delete_db_hashes(bot):
     rss._feed_add(bot, '#channel', 'feedname', FEED_VALID)
+    rss._feed_update(bot, rss.MockFeedReader(FEED_VALID), 'feedname', False)
     rss._feed_delete(bot, 'feedname')
-    result = rss._db_check_if_table_exists(bot, 'feedname')
-    assert [] == result
+    assert 0 == rss._db_get_number_of_rows(bot, 'feedname')
 
 
 def test_feed_delete_delete_ring_buffer(bot):
@@ -718,6 +795,57 @@ def test_feed_exists_fails(bot):
     assert rss._feed_exists(bot, 'nofeed') == False
 
 
+def test_feed_fetch_feeds(bot, feedreader_feed_valid, feedreader_feed_invalid):
+    feedreaders = {'valid': feedreader_feed_valid, 'invalid': feedreader_feed_invalid}
+    feeds = rss._feed_fetch(bot, feedreaders)
+    assert ['invalid', 'valid'] == sorted(feeds)
+    assert 3 == len(feeds['valid']['entries'])
+    assert 0 == len(feeds['invalid']['entries'])
+
+
+def test_feed_fetch_parallel(bot):
+    class SlowFeedReader(rss.MockFeedReader):
+        def get_feed(self):
+            time.sleep(0.2)
+            return rss.MockFeedReader.get_feed(self)
+    feedreaders = dict()
+    for i in range(5):
+        feedreaders['feed' + str(i)] = SlowFeedReader(FEED_VALID)
+    start = time.time()
+    feeds = rss._feed_fetch(bot, feedreaders)
+    assert 5 == len(feeds)
+    assert time.time() - start < 0.6
+
+
+def test_feed_fetch_shared_url_once(bot):
+    class CountingFeedReader(rss.MockFeedReader):
+        calls = 0
+        def get_feed(self):
+            CountingFeedReader.calls += 1
+            return rss.MockFeedReader.get_feed(self)
+    feedreader = CountingFeedReader(FEED_VALID)
+    feeds = rss._feed_fetch(bot, {'feed1': feedreader, 'feed2': feedreader, 'feed3': CountingFeedReader(FEED_VALID)})
+    assert ['feed1', 'feed2', 'feed3'] == sorted(feeds)
+    assert feeds['feed1'] is feeds['feed2']
+    assert 2 == CountingFeedReader.calls
+
+
+def test_feed_fetch_deadline(bot):
+    class SlowFeedReader(rss.MockFeedReader):
+        def get_feed(self):
+            time.sleep(0.5)
+            return rss.MockFeedReader.get_feed(self)
+    bot.config.rss.fetch_deadline = 0.1
+    feedreaders = {'fast': rss.MockFeedReader(FEED_VALID), 'slow': SlowFeedReader(FEED_VALID)}
+    feeds = rss._feed_fetch(bot, feedreaders)
+    assert ['fast'] == sorted(feeds)
+    assert 'slow' in bot.memory['rss']['fetching']
+    time.sleep(0.5)
+    feeds = rss._feed_fetch(bot, {'slow': feedreaders['slow']})
+    assert ['slow'] == sorted(feeds)
+    assert {} == bot.memory['rss']['fetching']
+
+
 def test_feed_list_format(bot):
     rss._feed_add(bot, 'channel', 'feed', FEED_VALID, 'f=ft+ftldsapg')
     rss._feed_list(bot, 'feed')
@@ -733,7 +861,7 @@ def test_feed_update_messages(bot, feedreader_feed_valid):
 
 def test_feed_update_store_hashes(bot, feedreader_feed_valid):
     rss._feed_update(bot, feedreader_feed_valid, 'feed1', True)
-    expected = ['f3ec142344be7e04431001e0dc658ed0', '601daf484a5766ecff6f6d1dc19131dc', '53c674b8916ad03755a6f8b679515b3a']
+    expected = [bytes.fromhex(hash) for hash in ['f3ec142344be7e04431001e0dc658ed0', '601daf484a5766ecff6f6d1dc19131dc', '53c674b8916ad03755a6f8b679515b3a']]
     hashes = bot.memory['rss']['hashes']['feed1'].get()
     assert expected == hashes
 
@@ -745,15 +873,502 @@ def test_feed_update_no_update(bot, feedreader_feed_valid):
     assert '' == bot.output
 
 
+FEED_ITEM_NEW = '''<item>
+<title>Title 4</title>
+<link>http://www.site1.com/article4</link>
+<pubDate>Sat, 24 Aug 2016 04:40:44 +0000</pubDate>
+</item>
+'''
+
+FEED_ITEM_OLD = '''<item>
+<title>Title 0</title>
+<link>http://www.site1.com/article0</link>
+<pubDate>Sat, 20 Aug 2016 00:00:00 +0000</pubDate>
+</item>
+
+</channel>'''
+
+
+def test_feed_update_stop_at_known_items(bot, feedreader_feed_valid):
+    rss._feed_update(bot, feedreader_feed_valid, 'feed1', False)
+    bot.output = ''
+    feed = FEED_VALID.replace('<item>', FEED_ITEM_NEW + '<item>', 1).replace('</channel>', FEED_ITEM_OLD)
+    rss._feed_update(bot, rss.MockFeedReader(feed), 'feed1', False)
+    expected = '\x02[feed1]\x02 Title 4 \x02→\x02 http://www.site1.com/article4\n'
+    assert expected == bot.output
+
+
+def test_feed_update_unordered_reads_all_items(bot, feedreader_feed_valid):
+    rss._feed_update(bot, feedreader_feed_valid, 'feed1', False)
+    bot.output = ''
+    feed = FEED_VALID.replace('</channel>', FEED_ITEM_OLD).replace('Sat, 22 Aug', 'Sat, 25 Aug')
+    rss._feed_update(bot, rss.MockFeedReader(feed), 'feed1', False)
+    expected = '\x02[feed1]\x02 Title 0 \x02→\x02 http://www.site1.com/article0\n'
+    assert expected == bot.output
+
+
+def test_feed_entries_newest_first(feedreader_feed_valid):
+    entries = feedreader_feed_valid.get_feed().entries
+    assert entries == rss._feed_entries_newest_first(entries)
+    assert entries == rss._feed_entries_newest_first(list(reversed(entries)))
+    assert None == rss._feed_entries_newest_first([entries[1], entries[0], entries[2]])
+    assert None == rss._feed_entries_newest_first(rss.MockFeedReader(FEED_BASIC).get_feed().entries)
+
+
+def test_feed_update_equal_dates_oldest_first(bot):
+    item = '<item><title>Title {0}</title><link>http://www.site1.com/article{0}</link><pubDate>Sat, 23 Aug 2016 03:30:33 +0000</pubDate></item>'
+    feed = '<?xml version="1.0" encoding="utf-8" ?><rss version="2.0"><channel><title>Site 1</title>{}</channel></rss>'
+    assert None == rss._feed_entries_newest_first(rss.MockFeedReader(feed.format(item.format(1) + item.format(2))).get_feed().entries)
+    rss._feed_update(bot, rss.MockFeedReader(feed.format(''.join(item.format(i) for i in range(5)))), 'feed1', False)
+    bot.output = ''
+    rss._feed_update(bot, rss.MockFeedReader(feed.format(''.join(item.format(i) for i in range(7)))), 'feed1', False)
+    assert 2 == bot.output.count('Title')
+    assert 'Title 5' in bot.output and 'Title 6' in bot.output
+
+
+def test_feed_update_not_modified(bot, feedreader_feed_valid):
+    feed = feedreader_feed_valid.get_feed()
+    feed['status'] = 304
+    rss._feed_post(bot, feed, 'feed1', False)
+    assert '' == bot.output
+    assert [] == bot.memory['rss']['hashes']['feed1'].get()
+
+
+class MockResponse:
+    def __init__(self, url, body, headers={}):
+        self.url = url
+        self.body = io.BytesIO(body)
+        self.headers = headers
+        self.status = 200
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def geturl(self):
+        return self.url
+
+    def read(self, size=-1):
+        return self.body.read(size)
+
+
+def _fixture_digest(text):
+    return hashlib.md5(text.encode('utf-8')).digest()
+
+
+def _fixture_urlopen(monkeypatch, body, headers={}):
+    requests = []
+    def urlopen(request, timeout=None):
+        requests.append((request, timeout))
+        if 'ETag' in headers and request.get_header('If-none-match') == headers['ETag']:
+            raise rss.urllib.error.HTTPError(request.full_url, 304, 'Not Modified', {}, None)
+        return MockResponse(request.full_url, body, headers)
+    monkeypatch.setattr(rss.urllib.request, 'urlopen', urlopen)
+    return requests
+
+
+FEED_NOT_A_FEED = '<html><body><p>not a feed</p>'
+
+
+def _fixture_urlopen_error(monkeypatch, code, headers={}):
+    def urlopen(request, timeout=None):
+        raise rss.urllib.error.HTTPError(request.full_url, code, 'Error', headers, None)
+    monkeypatch.setattr(rss.urllib.request, 'urlopen', urlopen)
+
+
+def test_feed_update_forgets_validators_if_posting_fails(bot, monkeypatch):
+    _fixture_urlopen(monkeypatch, FEED_VALID.encode('utf-8'), {'ETag': '"etag"'})
+    feedreader = rss.FeedReader('http://www.site1.com/feed')
+    say = bot.say
+    def failing_say(message, channel=''):
+        raise RuntimeError('disconnected')
+    bot.say = failing_say
+    with pytest.raises(RuntimeError):
+        rss._feed_update(bot, feedreader, 'feed1', False)
+    assert None == feedreader.etag
+    assert None == feedreader.digest
+    bot.say = say
+    rss._feed_update(bot, feedreader, 'feed1', False)
+    assert 3 == bot.output.count('Title')
+
+
+def test_feedreader_error_status(monkeypatch):
+    _fixture_urlopen_error(monkeypatch, 404)
+    feed = rss.FeedReader('http://www.site1.com/feed').get_feed()
+    assert 404 == feed['status']
+    assert None == feed['retry_after']
+    assert rss._feed_failed(feed)
+
+
+def test_feedreader_retry_after_seconds(monkeypatch):
+    _fixture_urlopen_error(monkeypatch, 503, {'Retry-After': '120'})
+    feed = rss.FeedReader('http://www.site1.com/feed').get_feed()
+    assert 120 == feed['retry_after']
+
+
+def test_feedreader_retry_after_date(monkeypatch):
+    date = rss.email.utils.formatdate(time.time() + 3600, usegmt=True)
+    _fixture_urlopen_error(monkeypatch, 429, {'Retry-After': date})
+    feed = rss.FeedReader('http://www.site1.com/feed').get_feed()
+    assert 3590 < feed['retry_after'] <= 3600
+
+
+def test_feed_failed(feedreader_feed_valid):
+    assert rss._feed_failed(dict())
+    assert rss._feed_failed(rss.MockFeedReader(FEED_NOT_A_FEED).get_feed())
+    assert not rss._feed_failed(rss.MockFeedReader(FEED_INVALID).get_feed())
+    assert not rss._feed_failed(feedreader_feed_valid.get_feed())
+    assert not rss._feed_failed(rss.feedparser.FeedParserDict(status=304, entries=[]))
+
+
+def test_feedreader_conditional_request(monkeypatch):
+    headers = {'ETag': '"abc"', 'Last-Modified': 'Sat, 03 Sep 2016 10:00:00 GMT'}
+    requests = _fixture_urlopen(monkeypatch, FEED_VALID.encode('utf-8'), headers)
+    feedreader = rss.FeedReader('http://www.site1.com/feed')
+    feed = feedreader.get_feed()
+    assert 200 == feed['status']
+    assert 3 == len(feed['entries'])
+    feed = feedreader.get_feed()
+    assert 304 == feed['status']
+    assert [] == feed['entries']
+    assert '"abc"' == requests[1][0].get_header('If-none-match')
+    assert 'Sat, 03 Sep 2016 10:00:00 GMT' == requests[1][0].get_header('If-modified-since')
+
+
+def test_feedreader_unchanged_body(monkeypatch):
+    requests = _fixture_urlopen(monkeypatch, FEED_VALID.encode('utf-8'))
+    parse = rss._feed_parse
+    parsed = []
+    def count(*args, **kwargs):
+        parsed.append(args)
+        return parse(*args, **kwargs)
+    monkeypatch.setattr(rss, '_feed_parse', count)
+    feedreader = rss.FeedReader('http://www.site1.com/feed')
+    assert 3 == len(feedreader.get_feed()['entries'])
+    feed = feedreader.get_feed()
+    assert 304 == feed['status']
+    assert [] == feed['entries']
+    assert 2 == len(requests)
+    assert 1 == len(parsed)
+
+
+def test_feedreader_unchanged_body_not_a_feed(monkeypatch):
+    _fixture_urlopen(monkeypatch, FEED_NOT_A_FEED.encode('utf-8'))
+    feedreader = rss.FeedReader('http://www.site1.com/feed')
+    assert rss._feed_failed(feedreader.get_feed())
+    assert rss._feed_failed(feedreader.get_feed())
+
+
+def test_feedreader_timeout(monkeypatch):
+    requests = _fixture_urlopen(monkeypatch, FEED_VALID.encode('utf-8'))
+    feedreader = rss.FeedReader('http://www.site1.com/feed', 2.5)
+    feedreader.get_feed()
+    assert 2.5 == requests[0][1]
+
+
+def _fixture_server(request, body):
+    connections = []
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        def setup(self):
+            connections.append(self.client_address)
+            http.server.BaseHTTPRequestHandler.setup(self)
+        def do_GET(self):
+            if self.path.startswith('/private') and self.headers.get('Authorization') != 'Basic dXNlcjpwQHNz':
+                self.send_response(401)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            if self.path == '/moved':
+                self.send_response(301)
+                self.send_header('Location', '/feed')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            if self.path.endswith('?chunked'):
+                self.send_response(200)
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                for chunk in [body[:100], body[100:], b'']:
+                    self.wfile.write('{:x}\r\n'.format(len(chunk)).encode('ascii') + chunk + b'\r\n')
+                return
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+            # hang up without telling the client like a server whose keep-alive timeout expired
+            self.close_connection = self.path.endswith('?close')
+        def log_message(self, *args):
+            pass
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    request.addfinalizer(server.server_close)
+    request.addfinalizer(server.shutdown)
+    return 'http://127.0.0.1:{}'.format(server.server_address[1]), connections
+
+
+def test_feedreader_basic_authentication(request):
+    url, connections = _fixture_server(request, FEED_VALID.encode('utf-8'))
+    assert 401 == rss.FeedReader(url + '/private', 5).get_feed()['status']
+    feed = rss.FeedReader(url.replace('//', '//user:p%40ss@') + '/private', 5).get_feed()
+    assert 3 == len(feed['entries'])
+    assert url + '/private' == feed['href']
+
+
+def test_feedreader_connections_keep_alive(request):
+    url, connections = _fixture_server(request, FEED_VALID.encode('utf-8'))
+    pool = rss.ConnectionPool()
+    feedreader1 = rss.FeedReader(url + '/feed', 5, pool)
+    feedreader2 = rss.FeedReader(url + '/moved', 5, pool)
+    for feedreader in [feedreader1, feedreader2]:
+        feed = feedreader.get_feed()
+        assert 200 == feed['status']
+        assert 3 == len(feed['entries'])
+        assert url + '/feed' == feed['href']
+    assert 304 == feedreader1.get_feed()['status']
+    assert 1 == len(connections)
+    pool.close()
+
+
+def test_feedreader_connections_basic_authentication(request):
+    url, connections = _fixture_server(request, FEED_VALID.encode('utf-8'))
+    pool = rss.ConnectionPool()
+    with pytest.raises(rss.urllib.error.HTTPError):
+        pool.urlopen(rss.urllib.request.Request(url + '/private'), 5)
+    with pool.urlopen(rss.urllib.request.Request(url.replace('//', '//user:p%40ss@') + '/private'), 5) as response:
+        assert 200 == response.status
+        assert url + '/private' == response.geturl()
+    feed = rss.FeedReader(url.replace('//', '//user:p%40ss@') + '/private', 5, pool).get_feed()
+    assert 3 == len(feed['entries'])
+    pool.close()
+
+
+def test_feedreader_connections_closed_by_server(request):
+    url, connections = _fixture_server(request, FEED_VALID.encode('utf-8'))
+    pool = rss.ConnectionPool()
+    feedreader = rss.FeedReader(url + '/feed?close', 5, pool)
+    assert 200 == feedreader.get_feed()['status']
+    time.sleep(0.1)
+    assert 304 == feedreader.get_feed()['status']
+    assert 2 == len(connections)
+    pool.close()
+
+
+def test_feedreader_connections_proxy(request, monkeypatch):
+    url, connections = _fixture_server(request, FEED_VALID.encode('utf-8'))
+    monkeypatch.setenv('http_proxy', url)
+    monkeypatch.setattr(rss.urllib.request, '_opener', None)
+    monkeypatch.setenv('no_proxy', 'www.site2.com')
+    assert rss._feed_proxied('http://www.site1.com/feed')
+    assert not rss._feed_proxied('http://www.site2.com/feed')
+    assert not rss._feed_proxied('https://www.site1.com/feed')
+    pool = rss.ConnectionPool()
+    feed = rss.FeedReader('http://www.site1.com/feed', 5, pool).get_feed()
+    assert 3 == len(feed['entries'])
+    assert 1 == len(connections)
+
+
+def test_feedreader_connections_carried_over(request):
+    url, connections = _fixture_server(request, FEED_VALID.encode('utf-8'))
+    pool = rss.ConnectionPool(1)
+    pool._acquire(('http', '127.0.0.1', int(url.rpartition(':')[2])), 1)
+    feed = rss.FeedReader(url + '/feed', 0.1, pool).get_feed()
+    assert feed['carried_over']
+    assert not rss._feed_failed(feed)
+
+
+def test_rss_update_carries_over_feed_without_free_connection(bot_rss_update):
+    class BusyFeedReader(rss.MockFeedReader):
+        def get_feed(self):
+            return rss.feedparser.FeedParserDict(href=self.url, carried_over=True, entries=[], feed=rss.feedparser.FeedParserDict())
+    bot_rss_update.memory['rss']['feedreaders']['feed1'] = BusyFeedReader(FEED_VALID)
+    due = rss._schedule_get(bot_rss_update, 'feed1').due
+    rss._rss_update(bot_rss_update, ['update'])
+    assert '' == bot_rss_update.output
+    assert 0 == rss._schedule_get(bot_rss_update, 'feed1').failures
+    assert due == rss._schedule_get(bot_rss_update, 'feed1').due
+    assert ['feed1'] == rss._schedule_pop(bot_rss_update, due)
+
+
+def test_feedreader_connections_per_host():
+    pool = rss.ConnectionPool(1)
+    key = ('http', 'www.site1.com', 80)
+    assert None == pool._acquire(key, 1)
+    with pytest.raises(rss.urllib.error.URLError):
+        pool._acquire(key, 0.1)
+    pool._release(key, rss.http.client.HTTPConnection('www.site1.com'), True)
+    assert None != pool._acquire(key, 1)
+
+
+def test_feedreader_async_keep_alive(request, engine):
+    url, connections = _fixture_server(request, FEED_VALID.encode('utf-8'))
+    feedreader1 = rss.FeedReader(url + '/feed', 5)
+    feedreader2 = rss.FeedReader(url + '/moved', 5)
+    for feedreader in [feedreader1, feedreader2]:
+        feed = engine.submit(feedreader.get_feed_async(engine)).result(5)
+        assert 200 == feed['status']
+        assert 3 == len(feed['entries'])
+        assert url + '/feed' == feed['href']
+    assert 304 == engine.submit(feedreader1.get_feed_async(engine)).result(5)['status']
+    assert 1 == len(connections)
+
+
+def test_feedreader_async_basic_authentication(request, engine):
+    url, connections = _fixture_server(request, FEED_VALID.encode('utf-8'))
+    with pytest.raises(rss.urllib.error.HTTPError):
+        engine.submit(engine.urlopen(url + '/private', {}, 5)).result(5)
+    response = engine.submit(engine.urlopen(url.replace('//', '//user:p%40ss@') + '/private', {}, 5)).result(5)
+    assert 200 == response.status
+    engine.submit(response.close()).result(5)
+    feedreader = rss.FeedReader(url.replace('//', '//user:p%40ss@') + '/private', 5)
+    feed = engine.submit(feedreader.get_feed_async(engine)).result(5)
+    assert 3 == len(feed['entries'])
+    assert url + '/private' == feed['href']
+
+
+def test_feedreader_async_chunked_closed_by_server(request, engine):
+    url, connections = _fixture_server(request, FEED_VALID.encode('utf-8'))
+    feedreader = rss.FeedReader(url + '/feed?chunked', 5)
+    assert 3 == len(engine.submit(feedreader.get_feed_async(engine)).result(5)['entries'])
+    feedreader = rss.FeedReader(url + '/feed?close', 5)
+    assert 200 == engine.submit(feedreader.get_feed_async(engine)).result(5)['status']
+    time.sleep(0.1)
+    assert 304 == engine.submit(feedreader.get_feed_async(engine)).result(5)['status']
+    assert 2 == len(connections)
+
+
+def test_feedreader_async_proxy(request, monkeypatch, engine):
+    url, connections = _fixture_server(request, FEED_VALID.encode('utf-8'))
+    monkeypatch.setenv('http_proxy', url)
+    monkeypatch.setattr(rss.urllib.request, '_opener', None)
+    feedreader = rss.FeedReader('http://www.site1.com/feed', 5)
+    feed = engine.submit(feedreader.get_feed_async(engine)).result(5)
+    assert 3 == len(feed['entries'])
+    assert len(FEED_VALID.encode('utf-8')) == feedreader.bytes_last
+    assert 1 == len(connections)
+
+
+def test_feedreader_async_carried_over(request):
+    url, connections = _fixture_server(request, FEED_VALID.encode('utf-8'))
+    engine = rss.AsyncEngine(1)
+    request.addfinalizer(engine.shutdown)
+    engine.submit(engine._acquire(('http', '127.0.0.1', int(url.rpartition(':')[2])), 1)).result(5)
+    feed = engine.submit(rss.FeedReader(url + '/feed', 0.1).get_feed_async(engine)).result(5)
+    assert feed['carried_over']
+    assert not rss._feed_failed(feed)
+
+
+def test_feedreader_async_max_bytes(request, engine):
+    body = FEED_VALID.encode('utf-8')
+    url, connections = _fixture_server(request, body)
+    feedreader = rss.FeedReader(url + '/feed?chunked', 5, max_bytes=len(body) - 1)
+    assert rss._feed_failed(engine.submit(feedreader.get_feed_async(engine)).result(5))
+    assert len(body) == feedreader.bytes_last
+
+
+def test_feedreader_gzip(monkeypatch):
+    _fixture_urlopen(monkeypatch, gzip.compress(FEED_VALID.encode('utf-8')), {'Content-Encoding': 'gzip'})
+    feedreader = rss.FeedReader('http://www.site1.com/feed')
+    assert 3 == len(feedreader.get_feed()['entries'])
+    assert len(gzip.compress(FEED_VALID.encode('utf-8'))) == feedreader.bytes_last
+
+
+def test_feedreader_max_bytes(monkeypatch):
+    body = FEED_VALID.encode('utf-8')
+    _fixture_urlopen(monkeypatch, body)
+    feedreader = rss.FeedReader('http://www.site1.com/feed', max_bytes=len(body))
+    assert 3 == len(feedreader.get_feed()['entries'])
+    feedreader = rss.FeedReader('http://www.site1.com/feed', max_bytes=len(body) - 1)
+    feed = feedreader.get_feed()
+    assert rss._feed_failed(feed)
+    assert len(body) == feedreader.bytes_last
+
+
+def test_feedreader_max_bytes_content_length(monkeypatch):
+    _fixture_urlopen(monkeypatch, FEED_VALID.encode('utf-8'), {'Content-Length': '1000000'})
+    feedreader = rss.FeedReader('http://www.site1.com/feed', max_bytes=1000)
+    assert rss._feed_failed(feedreader.get_feed())
+    assert 0 == feedreader.bytes_total
+
+
+def test_feedreader_max_bytes_gzip(monkeypatch):
+    _fixture_urlopen(monkeypatch, gzip.compress(b' ' * 10000000), {'Content-Encoding': 'gzip'})
+    feedreader = rss.FeedReader('http://www.site1.com/feed', max_bytes=100000)
+    assert rss._feed_failed(feedreader.get_feed())
+    assert 100000 > feedreader.bytes_total
+
+
+def test_feedreader_bytes_total(monkeypatch):
+    body = FEED_VALID.encode('utf-8')
+    _fixture_urlopen(monkeypatch, body)
+    feedreader = rss.FeedReader('http://www.site1.com/feed')
+    feedreader.get_feed()
+    feedreader.get_feed()
+    assert len(body) == feedreader.bytes_last
+    assert 2 * len(body) == feedreader.bytes_total
+
+
+def test_feed_list_bytes(bot):
+    feedreader = rss.FeedReader('http://www.site1.com/feed')
+    feedreader.bytes_last = 2048
+    feedreader.bytes_total = 10240
+    bot.memory['rss']['feedreaders']['feed1'] = feedreader
+    rss._feed_list(bot, 'feed1')
+    assert bot.output.endswith(' (read 2 kB last time, 10 kB in total)\n')
+
+
 def test_hashes_read(bot, feedreader_feed_valid):
     rss._feed_update(bot, feedreader_feed_valid, 'feed1', True)
-    expected = ['f3ec142344be7e04431001e0dc658ed0', '601daf484a5766ecff6f6d1dc19131dc', '53c674b8916ad03755a6f8b679515b3a']
+    expected = [bytes.fromhex(hash) for hash in ['f3ec142344be7e04431001e0dc658ed0', '601daf484a5766ecff6f6d1dc19131dc', '53c674b8916ad03755a6f8b679515b3a']]
     bot.memory['rss']['hashes']['feed1'] = rss.RingBuffer(100)
     rss._hashes_read(bot, 'feed1')
     hashes = bot.memory['rss']['hashes']['feed1'].get()
     assert expected == hashes
 
 
+def test_hashes_get_reads_database_lazily(bot, feedreader_feed_valid):
+    rss._feed_update(bot, feedreader_feed_valid, 'feed1', True)
+    del(bot.memory['rss']['hashes']['feed1'])
+    hashes = rss._hashes_get(bot, 'feed1')
+    assert hashes is bot.memory['rss']['hashes']['feed1']
+    assert 3 == len(hashes)
+    assert hashes is rss._hashes_get(bot, 'feed1')
+
+
+def test_hashes_get_first_update_posts_nothing_known(bot, feedreader_feed_valid):
+    rss._feed_update(bot, feedreader_feed_valid, 'feed1', True)
+    bot.output = ''
+    del(bot.memory['rss']['hashes']['feed1'])
+    rss._feed_update(bot, feedreader_feed_valid, 'feed1', False)
+    assert '' == bot.output
+
+
+def test_hashes_read_all(bot, feedreader_feed_valid):
+    rss._feed_add(bot, '#channel', 'feed2', FEED_VALID)
+    rss._feed_update(bot, feedreader_feed_valid, 'feed1', False)
+    rss._feed_update(bot, feedreader_feed_valid, 'feed2', False)
+    expected1 = bot.memory['rss']['hashes']['feed1'].get()
+    expected2 = bot.memory['rss']['hashes']['feed2'].get()
+    del(bot.memory['rss']['hashes']['feed1'])
+    del(bot.memory['rss']['hashes']['feed2'])
+    rss._hashes_read_all(bot)
+    assert expected1 == bot.memory['rss']['hashes']['feed1'].get()
+    assert expected2 == bot.memory['rss']['hashes']['feed2'].get()
+
+
+def test_hashes_read_all_keeps_ring_buffers_in_use(bot, feedreader_feed_valid):
+    rss._feed_update(bot, feedreader_feed_valid, 'feed1', False)
+    hashes = rss.RingBuffer(100)
+    bot.memory['rss']['hashes']['feed1'] = hashes
+    rss._hashes_read_all(bot)
+    assert hashes is bot.memory['rss']['hashes']['feed1']
+    assert [] == hashes.get()
+
+
 def test_help_config_formats(bot):
     rss._help_config(bot, ['help', 'config', 'formats'])
     expected = rss.CONFIG['formats']['synopsis'].format(bot.config.core.prefix) + '\n'
@@ -1102,6 +1717,19 @@ def test_rss_list_no_feed_found(bot):
     assert '' == bot.output
 
 
+def test_rss_list_health(bot):
+    schedule = rss._schedule_get(bot, 'feed1')
+    schedule.fail(time.time())
+    schedule.fail(time.time())
+    rss._rss_list(bot, ['list', 'feed1'])
+    assert bot.output.startswith('#channel1 feed1 http://www.site1.com/feed (failed 2 times, next try in ')
+    bot.output = ''
+    schedule.failures = schedule.quarantine - 1
+    schedule.fail(time.time())
+    rss._rss_list(bot, ['list', 'feed1'])
+    assert '(quarantined after 10 failures, next try in ' in bot.output
+
+
 def test_rss_templates_get_default(bot):
     rss._rss_templates(bot, ['templates', 'feed1'])
     assert '' == bot.output
@@ -1156,6 +1784,11 @@ def test_rss_update_update(bot_rss_update):
     assert expected == bot_rss_update.output
 
 
+def test_rss_update_save_hashes(bot_rss_update):
+    rss._rss_update(bot_rss_update, ['update'])
+    assert 3 == rss._db_get_number_of_rows(bot_rss_update, 'feed1')
+
+
 def test_rss_update_no_update(bot_rss_update):
     rss._rss_update(bot_rss_update, ['update'])
     bot.output = ''
@@ -1163,6 +1796,39 @@ def test_rss_update_no_update(bot_rss_update):
     assert '' == bot.output
 
 
+def test_rss_update_interval_reads_due_feeds_only(bot_rss_update):
+    rss._rss_update(bot_rss_update, ['update'])
+    schedule = bot_rss_update.memory['rss']['schedules']['feed1']
+    assert time.time() < schedule.due
+    bot_rss_update.output = ''
+    feed = FEED_VALID.replace('<item>', FEED_ITEM_NEW + '<item>', 1)
+    bot_rss_update.memory['rss']['feedreaders']['feed1'] = rss.MockFeedReader(feed)
+    rss._rss_update(bot_rss_update)
+    assert '' == bot_rss_update.output
+    schedule.due = 0
+    rss._schedule_push(bot_rss_update, 'feed1')
+    rss._rss_update(bot_rss_update)
+    expected = '\x02[feed1]\x02 Title 4 \x02→\x02 http://www.site1.com/article4\n'
+    assert expected == bot_rss_update.output
+
+
+def test_rss_update_skip_overlapping_update(bot_rss_update):
+    bot_rss_update.memory['rss']['updating'].acquire()
+    rss._rss_update(bot_rss_update)
+    assert '' == bot_rss_update.output
+    bot_rss_update.memory['rss']['updating'].release()
+    rss._rss_update(bot_rss_update, ['update'])
+    assert 3 == rss._db_get_number_of_rows(bot_rss_update, 'feed1')
+
+
+def test_rss_update_save_feeds(bot_rss_update):
+    rss._rss_update(bot_rss_update, ['update'])
+    rows = rss._db_read_feeds_from_database(bot_rss_update)
+    assert 1 == len(rows)
+    assert 'feed1' == rows[0][0]
+    assert bot_rss_update.memory['rss']['schedules']['feed1'].due == rows[0][1]
+
+
 def test_options_get_format_custom(bot, feedreader_feed_valid):
     options = rss.Options(bot, feedreader_feed_valid, 'f=ta+ta')
     assert 'f=ta+ta' == options.get_format()
@@ -1185,6 +1851,39 @@ def test_options_get_fields_feed_item_neither_title_nor_description(bot, feedrea
     assert 'd' not in fields and 't' not in fields
 
 
+def test_options_get_fields_read_once(bot):
+    class CountingFeedReader(rss.MockFeedReader):
+        count = 0
+        def get_feed(self):
+            CountingFeedReader.count += 1
+            return rss.MockFeedReader.get_feed(self)
+    options = rss.Options(bot, CountingFeedReader(FEED_VALID), 'f=fl+ftl;t=t|>>{}<<')
+    options.get_fields()
+    options.set_format('f=fla+ftla')
+    options.set_templates('t=l|->{}<-')
+    assert 'fadglpsty' == options.get_fields()
+    assert 1 == CountingFeedReader.count
+
+
+def test_options_without_validation_checks_format_syntax(bot):
+    class FailingFeedReader(rss.MockFeedReader):
+        def get_feed(self):
+            raise AssertionError('the feed must not be read')
+    feedreader = FailingFeedReader(FEED_VALID)
+    for format in ['f=fl+fzt', 'f=fl', 'f=f+t', 'f=fl+ftl+t', 'f=ll+ft']:
+        assert 'f=' + rss.FORMAT_DEFAULT == rss.Options(bot, feedreader, format, False).get_format()
+    assert 'f=fla+ftla' == rss.Options(bot, feedreader, 'f=fla+ftla', False).get_format()
+
+
+def test_options_set_fields(bot, feedreader_feed_valid):
+    options = rss.Options(bot, rss.MockFeedReader(FEED_BASIC))
+    assert 'flty' == options.get_fields()
+    options.set_fields(feedreader_feed_valid.get_feed())
+    assert 'fadglpsty' == options.get_fields()
+    options.set_fields(dict())
+    assert 'fadglpsty' == options.get_fields()
+
+
 def test_options_check_format_default(bot, feedreader_feed_valid):
     options = rss.Options(bot, feedreader_feed_valid)
     assert options.get_format_default() == options.get_format()
@@ -1243,10 +1942,66 @@ def test_options_check_tinyurl_output(bot, feedreader_feed_valid):
     options = rss.Options(bot, feedreader_feed_valid, format)
     item = feedreader_feed_valid.get_feed().entries[0]
     post = options.get_post('feed1', item)
-    expected = 'Title 3 \x02→\x02 https://tinyurl.com/govvpmm'
+    expected = 'Title 3 \x02→\x02 ' + MockShortener().shorten('http://www.site1.com/article3')
     assert expected == post
 
 
+def test_options_get_plan_compiled_once(bot, feedreader_feed_valid):
+    class CountingOptions(rss.Options):
+        count = 0
+        def template_to_irc(self, template):
+            CountingOptions.count += 1
+            return rss.Options.template_to_irc(self, template)
+    options = CountingOptions(bot, feedreader_feed_valid, 'f=fl+ftl')
+    items = feedreader_feed_valid.get_feed().entries
+    CountingOptions.count = 0
+    for item in items:
+        options.get_post('feed1', item)
+    count = CountingOptions.count
+    for item in items:
+        options.get_post('feed1', item)
+    assert count == CountingOptions.count
+    assert ['f', 't', 'l'] == list(options.get_plan())
+
+
+def test_options_get_plan_set_templates(bot, feedreader_feed_valid):
+    options = rss.Options(bot, feedreader_feed_valid, 'f=fl+tl')
+    item = feedreader_feed_valid.get_feed().entries[0]
+    assert 'Title 3 \x02→\x02 http://www.site1.com/article3' == options.get_post('feed1', item)
+    options.set_templates('t=t|>>{}<<')
+    assert '>>Title 3<< \x02→\x02 http://www.site1.com/article3' == options.get_post('feed1', item)
+    options.set_format('f=fl+t')
+    assert '>>Title 3<<' == options.get_post('feed1', item)
+
+
+def test_options_get_plan_config_templates(bot, feedreader_feed_valid):
+    item = feedreader_feed_valid.get_feed().entries[0]
+    options = bot.memory['rss']['options']['feed1']
+    assert '\x02[feed1]\x02 Title 3 \x02→\x02 http://www.site1.com/article3' == options.get_post('feed1', item)
+    rss._config_set_templates(bot, 't=t|>>{}<<')
+    assert '\x02[feed1]\x02 >>Title 3<< \x02→\x02 http://www.site1.com/article3' == options.get_post('feed1', item)
+
+
+def test_options_get_item_fields(bot, feedreader_feed_valid):
+    options = rss.Options(bot, feedreader_feed_valid, 'f=fl+ftl')
+    entry = feedreader_feed_valid.get_feed().entries[0]
+    item = options.get_item('feed1', entry)
+    assert 'feed1' == item.feedname
+    assert 'Title 3' == item.title
+    assert 'http://www.site1.com/article3' == item.link
+    assert '' == item.author
+    assert not hasattr(item, '__dict__')
+
+
+def test_options_get_item_hash_and_post(bot, feedreader_feed_valid):
+    options = rss.Options(bot, feedreader_feed_valid, 'f=fpl+ftpl')
+    entry = feedreader_feed_valid.get_feed().entries[0]
+    item = options.get_item('feed1', entry)
+    assert options.get_hash('feed1', entry) == options.get_hash('feed1', item)
+    assert options.get_post('feed1', entry) == options.get_post('feed1', item)
+    assert '\x02[feed1]\x02 Title 3 (2016-08-23 03:30) \x02→\x02 http://www.site1.com/article3' == options.get_post('feed1', item)
+
+
 def test_options_check_template_valid(bot):
     template = '{}'
     result = rss.Options(bot, rss.FeedReader('')).is_template_valid(template)
@@ -1277,15 +2032,540 @@ def test_options_set_get_templates(bot):
 def test_ringbuffer_append():
     rb = rss.RingBuffer(3)
     assert rb.get() == []
-    rb.append('1')
-    assert ['1'] == rb.get()
+    rb.append(_fixture_digest('1'))
+    assert [_fixture_digest('1')] == rb.get()
 
 
 def test_ringbuffer_overflow():
     rb = rss.RingBuffer(3)
-    rb.append('hash1')
-    rb.append('hash2')
-    rb.append('hash3')
-    assert ['hash1', 'hash2', 'hash3'] == rb.get()
-    rb.append('hash4')
-    assert ['hash2', 'hash3', 'hash4'] == rb.get()
+    rb.append(_fixture_digest('hash1'))
+    rb.append(_fixture_digest('hash2'))
+    rb.append(_fixture_digest('hash3'))
+    assert [_fixture_digest('hash1'), _fixture_digest('hash2'), _fixture_digest('hash3')] == rb.get()
+    rb.append(_fixture_digest('hash4'))
+    assert [_fixture_digest('hash2'), _fixture_digest('hash3'), _fixture_digest('hash4')] == rb.get()
+
+
+def test_ringbuffer_contains():
+    rb = rss.RingBuffer(3)
+    rb.append(_fixture_digest('hash1'))
+    rb.append(_fixture_digest('hash2'))
+    rb.append(_fixture_digest('hash3'))
+    assert _fixture_digest('hash1') in rb
+    rb.append(_fixture_digest('hash4'))
+    assert _fixture_digest('hash1') not in rb
+    assert _fixture_digest('hash4') in rb
+
+
+def test_ringbuffer_duplicate():
+    rb = rss.RingBuffer(3)
+    rb.append(_fixture_digest('hash1'))
+    rb.append(_fixture_digest('hash2'))
+    rb.append(_fixture_digest('hash1'))
+    assert [_fixture_digest('hash1'), _fixture_digest('hash2')] == rb.get()
+
+
+def test_ringbuffer_iter():
+    rb = rss.RingBuffer(3)
+    for i in range(5):
+        rb.append(_fixture_digest('hash' + str(i)))
+    assert rb.get() == list(rb)
+    assert 3 == len(rb)
+
+
+def test_ringbuffer_many_digests():
+    rb = rss.RingBuffer(rss.MAX_HASHES_PER_FEED)
+    digests = [_fixture_digest(str(i)) for i in range(3 * rss.MAX_HASHES_PER_FEED)]
+    for digest in digests:
+        rb.append(digest)
+    assert digests[-rss.MAX_HASHES_PER_FEED:] == rb.get()
+    assert all(digest in rb for digest in digests[-rss.MAX_HASHES_PER_FEED:])
+    assert not any(digest in rb for digest in digests[:-rss.MAX_HASHES_PER_FEED])
+    assert rss.MAX_HASHES_PER_FEED * rss.DIGEST_SIZE == len(rb.data)
+
+
+FEED_HINTS = FEED_VALID.replace('<item>', '''<ttl>120</ttl>
+<skipHours><hour>0</hour><hour>1</hour><hour>23</hour></skipHours>
+<skipDays><day>Saturday</day><day>Sunday</day></skipDays>
+<item>''', 1)
+
+
+def test_feed_skip_hints(bot):
+    feed = rss.MockFeedReader(FEED_HINTS).get_feed()
+    assert [0, 1, 23] == feed['feed']['skiphours']
+    assert ['Saturday', 'Sunday'] == feed['feed']['skipdays']
+
+
+def test_schedule_first_update_is_due_after_floor():
+    schedule = rss.Schedule(60, 3600, 0)
+    assert 0 >= schedule.due
+    schedule.update(1000, 20)
+    assert 60 == schedule.interval
+    assert 1059 < schedule.due <= 1060
+
+
+def test_schedule_fast_feed_stays_at_floor():
+    schedule = rss.Schedule(60, 3600, 0)
+    schedule.update(0, 20)
+    for now in range(60, 1200, 60):
+        schedule.update(now, 1)
+        assert 60 == schedule.interval
+
+
+def test_schedule_quiet_feed_slows_down():
+    schedule = rss.Schedule(60, 3600, 0)
+    schedule.update(0, 20)
+    now = 0
+    polls = 0
+    while now < 86400:
+        now = schedule.due
+        schedule.update(now, 0)
+        polls += 1
+    assert 3600 == schedule.interval
+    assert polls < 1440 / 10
+
+
+def test_schedule_learns_publish_rate():
+    schedule = rss.Schedule(60, 86400, 0)
+    schedule.update(0, 20)
+    for now in range(3600, 36001, 3600):
+        schedule.update(now, 1)
+    assert 1800 == schedule.interval
+
+
+def test_schedule_honours_ttl():
+    schedule = rss.Schedule(60, 86400, 0)
+    feed = rss.MockFeedReader(FEED_HINTS).get_feed()
+    feed['feed']['skiphours'] = []
+    feed['feed']['skipdays'] = []
+    schedule.update(0, 20, feed)
+    assert 7200 == schedule.interval
+
+
+def test_schedule_keeps_ttl_if_not_modified():
+    schedule = rss.Schedule(60, 86400, 0)
+    schedule.update(0, 20, rss.MockFeedReader(FEED_HINTS).get_feed())
+    schedule.update(0, 0, rss.feedparser.FeedParserDict(status=304, entries=[], feed=rss.feedparser.FeedParserDict()))
+    assert 7200 == schedule.ttl
+
+
+def test_schedule_honours_skip_hours_and_days():
+    schedule = rss.Schedule(60, 3600, 0)
+    feed = rss.MockFeedReader(FEED_HINTS).get_feed()
+    feed['feed']['ttl'] = ''
+
+    # friday, 2016-09-02 22:59:30 UTC is followed by the skipped hour 23 and the weekend
+    now = calendar.timegm((2016, 9, 2, 22, 59, 30, 0, 0, 0))
+    schedule.update(now, 20, feed)
+    assert calendar.timegm((2016, 9, 5, 2, 0, 0, 0, 0, 0)) == schedule.due
+
+
+def test_schedule_jitter():
+    schedule = rss.Schedule(60, 3600, 0.1)
+    dues = set()
+    for i in range(20):
+        schedule.update(1000, 0)
+        assert 1054 <= schedule.due <= 1066
+        dues.add(schedule.due)
+    assert 1 < len(dues)
+
+
+def test_schedule_state():
+    schedule = rss.Schedule(60, 3600, 0)
+    schedule.update(0, 20)
+    schedule.update(600, 2)
+    restored = rss.Schedule(60, 3600, 0)
+    restored.set_state(*schedule.get_state())
+    assert schedule.due == restored.due
+    assert schedule.started == restored.started
+    assert list(schedule.seen) == list(restored.seen)
+
+
+def test_schedule_get_spreads_new_feeds(bot):
+    before = time.time()
+    schedule = rss._schedule_get(bot, 'feed1')
+    assert before <= schedule.due <= time.time() + schedule.floor
+    assert (schedule.due, 'feed1') in bot.memory['rss']['queue']
+
+
+def test_schedule_pop_skips_stale_entries(bot):
+    rss._feed_add(bot, '#channel', 'feed2', FEED_VALID)
+    rss._feed_add(bot, '#channel', 'feed3', FEED_VALID)
+    bot.memory['rss']['schedules']['feed2'].due = 10
+    rss._schedule_push(bot, 'feed2')
+    bot.memory['rss']['schedules']['feed3'].due = 5
+    rss._schedule_push(bot, 'feed3')
+    rss._feed_delete(bot, 'feed3')
+    assert ['feed2'] == rss._schedule_pop(bot, 100)
+    assert [] == rss._schedule_pop(bot, 100)
+
+
+def test_schedule_read(bot):
+    rss._feed_add(bot, '#channel', 'feed2', 'http://www.site2.com/feed')
+    due = time.time() + 1000
+    sql_save_feed = 'INSERT INTO rss_feeds (feed_id, due, started, seen, etag, modified) VALUES (?, ?, ?, ?, ?, ?)'
+    bot.db.execute(sql_save_feed, ('feed2', due, 100, '200 300', '"etag"', 'Sat, 03 Sep 2016 10:00:00 GMT'))
+    rss._schedule_read(bot)
+    schedule = bot.memory['rss']['schedules']['feed2']
+    assert due == schedule.due
+    assert [200, 300] == list(schedule.seen)
+    assert '"etag"' == bot.memory['rss']['feedreaders']['feed2'].etag
+    assert 'Sat, 03 Sep 2016 10:00:00 GMT' == bot.memory['rss']['feedreaders']['feed2'].modified
+    assert ['feed2'] == rss._schedule_pop(bot, due)
+
+
+def test_schedule_read_shared_url_without_state(bot):
+    rss._feed_add(bot, '#channel', 'feed2', 'http://www.site2.com/feed')
+    rss._feed_add(bot, '#channel', 'feed3', 'http://www.site2.com/feed')
+    sql_save_feed = 'INSERT INTO rss_feeds (feed_id, due, started, seen, etag, modified) VALUES (?, ?, ?, ?, ?, ?)'
+    bot.db.execute(sql_save_feed, ('feed2', 0, 0, '', '"etag"', 'Sat, 03 Sep 2016 10:00:00 GMT'))
+    rss._schedule_read(bot)
+    assert bot.memory['rss']['feedreaders']['feed2'] is bot.memory['rss']['feedreaders']['feed3']
+    assert None == bot.memory['rss']['feedreaders']['feed3'].etag
+    assert None == bot.memory['rss']['feedreaders']['feed3'].modified
+    bot.db.execute(sql_save_feed, ('feed3', 0, 0, '', '"etag"', 'Sat, 03 Sep 2016 10:00:00 GMT'))
+    rss._schedule_read(bot)
+    assert '"etag"' == bot.memory['rss']['feedreaders']['feed3'].etag
+
+
+def test_schedule_read_spreads_overdue_feeds(bot):
+    rss._feed_add(bot, '#channel', 'feed2', 'http://www.site2.com/feed')
+    sql_save_feed = 'INSERT INTO rss_feeds (feed_id, due, started, seen, etag, modified) VALUES (?, ?, ?, ?, ?, ?)'
+    bot.db.execute(sql_save_feed, ('feed2', 0, 0, '', None, None))
+    rss._schedule_read(bot)
+    assert time.time() <= bot.memory['rss']['schedules']['feed2'].due
+
+
+def test_feed_delete_remove_feed_state(bot):
+    rss._feed_add(bot, '#channel', 'feed2', 'http://www.site2.com/feed')
+    rss._db_save_feeds_to_database(bot, ['feed2'])
+    assert 1 == len(rss._db_read_feeds_from_database(bot))
+    rss._feed_delete(bot, 'feed2')
+    assert [] == rss._db_read_feeds_from_database(bot)
+
+
+def test_schedule_fail_backs_off_exponentially():
+    schedule = rss.Schedule(60, 3600, 0, 3)
+    schedule.fail(0)
+    assert 120 == schedule.interval
+    schedule.fail(0)
+    assert 240 == schedule.interval
+    assert not schedule.is_quarantined()
+    schedule.fail(0)
+    assert schedule.is_quarantined()
+    assert rss.QUARANTINE_INTERVAL == schedule.due
+
+
+def test_schedule_fail_honours_retry_after():
+    schedule = rss.Schedule(60, 3600, 0)
+    schedule.fail(0, 7200)
+    assert 7200 == schedule.due
+
+
+def test_schedule_update_resets_failures():
+    schedule = rss.Schedule(60, 3600, 0, 3)
+    for i in range(3):
+        schedule.fail(0)
+    schedule.update(0, 0)
+    assert 0 == schedule.failures
+    assert not schedule.is_quarantined()
+
+
+def test_rss_update_backs_off_failing_feed(bot_rss_update):
+    bot_rss_update.memory['rss']['feedreaders']['feed1'] = rss.MockFeedReader(FEED_NOT_A_FEED)
+    rss._rss_update(bot_rss_update, ['update'])
+    schedule = bot_rss_update.memory['rss']['schedules']['feed1']
+    assert 1 == schedule.failures
+    assert 1 == rss._db_read_feeds_from_database(bot_rss_update)[0][4]
+
+
+def test_feed_normalize_url():
+    assert 'http://www.site1.com/feed?a=1' == rss._feed_normalize_url('HTTP://WWW.Site1.com:80/feed?a=1#top')
+    assert 'https://www.site1.com:8443/' == rss._feed_normalize_url('https://www.site1.com:8443')
+    assert FEED_VALID == rss._feed_normalize_url(FEED_VALID)
+
+
+FEED_ATOM = '''<?xml version="1.0" encoding="utf-8"?>
+<feed xmlns="http://www.w3.org/2005/Atom" xml:base="http://www.site1.com/">
+<title>Site 1 Articles</title>
+<link href="http://www.site1.com/"/>
+<updated>2016-08-23T03:30:33Z</updated>
+
+<entry>
+<title>Title 2</title>
+<link rel="alternate" type="text/html" href="article2"/>
+<link rel="enclosure" href="http://www.site1.com/article2.mp3"/>
+<id>tag:www.site1.com,2016:2</id>
+<published>2016-08-22T02:20:22Z</published>
+<updated>2016-08-23T03:30:33Z</updated>
+<author><name>Author 2</name><email>author2@site1.com</email></author>
+<summary>Summary of article 2 – café</summary>
+</entry>
+
+<entry>
+<title>Title 1</title>
+<id>http://www.site1.com/article1</id>
+<updated>2016-08-21T01:10:11Z</updated>
+<author><name>Author 1</name></author>
+<summary type="text">Summary of article 1</summary>
+<content type="html">&lt;p&gt;Content of article 1&lt;/p&gt;</content>
+</entry>
+
+</feed>'''
+
+
+def _fixture_parse(body, headers={'content-location': 'http://www.site1.com/feed', 'content-type': 'application/rss+xml; charset=utf-8'}):
+    fast = rss.FastFeedParser(dict(headers)).parse(body.encode('utf-8'))
+    slow = rss.feedparser.parse(rss.io.BytesIO(body.encode('utf-8')), response_headers=dict(headers))
+    return fast, slow
+
+
+@pytest.mark.parametrize('body', [FEED_VALID, FEED_BASIC, FEED_ATOM, FEED_ITEM_NEITHER_TITLE_NOR_DESCRIPTION], ids=['valid', 'basic', 'atom', 'neither'])
+def test_feed_parse_like_feedparser(bot, body):
+    fast, slow = _fixture_parse(body)
+    assert fast is not None
+    assert len(slow['entries']) == len(fast['entries'])
+    options = rss.Options(bot, rss.MockFeedReader(body), 'f=fadglpsty+fadglpsty')
+    assert options._format_get_fields(slow) == options._format_get_fields(fast)
+    for expected, entry in zip(slow['entries'], fast['entries']):
+        assert options.get_hash('feed', expected) == options.get_hash('feed', entry)
+        assert options.get_post('feed', expected) == options.get_post('feed', entry)
+        assert dict.get(expected, 'updated_parsed') == dict.get(entry, 'updated_parsed')
+
+
+def test_feed_parse_ttl():
+    fast, slow = _fixture_parse(FEED_HINTS)
+    assert '120' == fast['feed']['ttl'] == slow['feed']['ttl']
+
+
+@pytest.mark.parametrize('body', [
+    FEED_SPY,
+    FEED_NOT_A_FEED,
+    FEED_VALID.replace('<title>Title 2</title>', '<title>Title &lt;b&gt;2&lt;/b&gt;</title>'),
+    FEED_VALID.replace('<item>', '<item xml:base="http://www.site2.com/">', 1),
+    FEED_VALID.replace('<author>Author 1</author>', '<author>Author 1</author><media:title xmlns:media="http://search.yahoo.com/mrss/">Media</media:title>'),
+    FEED_VALID.replace('encoding="utf-8"', 'encoding="iso-8859-1"'),
+    FEED_ATOM.replace('<summary type="text">Summary of article 1</summary>', ''),
+], ids=['cdata', 'html', 'markup', 'base', 'namespace', 'encoding', 'content'])
+def test_feed_parse_falls_back_to_feedparser(body):
+    fast, slow = _fixture_parse(body)
+    assert fast is None
+    feed = rss._feed_parse(body.encode('utf-8'), {'content-location': 'http://www.site1.com/feed'})
+    assert len(slow['entries']) == len(feed['entries'])
+
+
+def test_feed_parse_encoding():
+    body = FEED_ATOM.encode('utf-8')
+    assert None == rss.FastFeedParser({'content-type': 'text/xml'}).parse(body.replace(b'encoding="utf-8"', b''))
+    assert None == rss.FastFeedParser({'content-type': 'application/xml; charset=iso-8859-1'}).parse(body)
+    assert None == rss.FastFeedParser({'date': 'today'}).parse(body.replace(b'encoding="utf-8"', b''))
+    assert None != rss.FastFeedParser({'content-type': 'text/xml'}).parse(body)
+    assert None != rss.FastFeedParser({'content-type': 'text/xml'}).parse(FEED_BASIC.encode('utf-8'))
+
+
+def test_parserpool_in_process():
+    parser = rss.ParserPool(0)
+    feed = parser.parse(FEED_VALID.encode('utf-8'), {})
+    assert 3 == len(feed['entries'])
+    assert None == parser.executor
+
+
+def test_parserpool_workers():
+    parser = rss.ParserPool(1)
+    body = FEED_VALID.encode('utf-8')
+    headers = {'content-location': 'http://www.site1.com/feed'}
+    feed = parser.parse(body, headers)
+    assert 'fork' != parser.executor._mp_context.get_start_method()
+    parser.shutdown()
+    expected = rss.feedparser.parse(rss.io.BytesIO(body), response_headers=headers)
+    assert 3 == len(feed['entries'])
+    for entry, expected_entry in zip(feed['entries'], expected['entries']):
+        assert sorted(entry) == sorted(key for key in expected_entry if key in rss.ParserPool.KEYS)
+        assert all(expected_entry[key] == entry[key] for key in entry)
+
+
+def test_parserpool_workers_module_loaded_from_file(monkeypatch):
+    spec = importlib.util.spec_from_file_location('rss_loaded_from_file', rss.__file__)
+    module = importlib.util.module_from_spec(spec)
+    monkeypatch.setitem(sys.modules, 'rss_loaded_from_file', module)
+    spec.loader.exec_module(module)
+    parser = module.ParserPool(1)
+    feed = parser.parse(FEED_VALID.encode('utf-8'), {})
+    assert 1 == parser.workers
+    parser.shutdown()
+    assert 3 == len(feed['entries'])
+
+
+def test_parserpool_falls_back_to_process_of_bot(monkeypatch):
+    parser = rss.ParserPool(1)
+    class BrokenExecutor:
+        def submit(self, *args):
+            raise rss.concurrent.futures.process.BrokenProcessPool()
+        def shutdown(self, wait=True):
+            pass
+    parser.executor = BrokenExecutor()
+    feed = parser.parse(FEED_VALID.encode('utf-8'), {})
+    assert 3 == len(feed['entries'])
+    assert 0 == parser.workers
+    assert None == parser.executor
+
+
+def test_feed_add_share_feedreader(bot):
+    rss._feed_add(bot, '#channel2', 'feed2', 'http://www.site2.com/feed')
+    bot.memory['rss']['feedreaders']['feed2'].etag = '"abc"'
+    rss._feed_add(bot, '#channel3', 'feed3', 'HTTP://www.site2.com/feed')
+    assert bot.memory['rss']['feedreaders']['feed2'] is bot.memory['rss']['feedreaders']['feed3']
+    assert None == bot.memory['rss']['feedreaders']['feed3'].etag
+    assert ['feed2', 'feed3'] == rss._feed_group(bot, 'feed2')
+    rss._feed_delete(bot, 'feed2')
+    assert ['feed3'] == rss._feed_group(bot, 'feed3')
+    rss._feed_delete(bot, 'feed3')
+    assert {} == bot.memory['rss']['urls']
+
+
+def test_rss_update_fan_out_shared_url(bot_rss_update):
+    rss._feed_add(bot_rss_update, '#channel1', 'feed1', FEED_VALID)
+    rss._feed_add(bot_rss_update, '#channel2', 'feed2', FEED_VALID)
+    bot_rss_update.memory['rss']['schedules']['feed1'].due = 0
+    rss._schedule_push(bot_rss_update, 'feed1')
+    bot_rss_update.memory['rss']['schedules']['feed2'].due = time.time() + 1000
+    rss._schedule_push(bot_rss_update, 'feed2')
+    rss._rss_update(bot_rss_update)
+    assert 6 == bot_rss_update.output.count('Title')
+    assert 3 == rss._db_get_number_of_rows(bot_rss_update, 'feed2')
+    assert time.time() + 1000 > bot_rss_update.memory['rss']['schedules']['feed2'].due
+
+
+def test_rss_update_saves_hashes_if_posting_fails(bot_rss_update):
+    rss._feed_add(bot_rss_update, '#channel2', 'feed2', FEED_VALID)
+    say = bot_rss_update.say
+    def failing_say(message, channel=''):
+        if channel == '#channel2':
+            raise RuntimeError('disconnected')
+        say(message, channel)
+    bot_rss_update.say = failing_say
+    with pytest.raises(RuntimeError):
+        rss._rss_update(bot_rss_update, ['update'])
+    assert 3 == bot_rss_update.output.count('Title')
+    assert 3 == rss._db_get_number_of_rows(bot_rss_update, 'feed1')
+    assert 0 == rss._db_get_number_of_rows(bot_rss_update, 'feed2')
+
+
+def test_rss_update_engine(bot_rss_update, engine):
+    bot_rss_update.memory['rss']['engine'] = engine
+    rss._rss_update(bot_rss_update, ['update'])
+    assert 3 == bot_rss_update.output.count('Title')
+    assert None == bot_rss_update.memory['rss']['executor']
+
+
+def test_shorturlcache_shorten(bot):
+    links = ['http://www.site1.com/article1', 'http://www.site1.com/article2', 'http://www.site1.com/article1']
+    shorturls = bot.memory['rss']['shorturls'].shorten(links)
+    assert 2 == len(shorturls)
+    assert MockShortener().shorten(links[0]) == shorturls[links[0]]
+    assert shorturls == rss._db_read_shorturls_from_database(bot, links[:2])
+
+
+def test_shorturlcache_read_database(bot):
+    rss._db_save_shorturls_to_database(bot, {'http://www.site1.com/article1': 'https://tinyurl.com/stored'})
+    shorturls = bot.memory['rss']['shorturls'].shorten(['http://www.site1.com/article1'])
+    assert 'https://tinyurl.com/stored' == shorturls['http://www.site1.com/article1']
+    assert 'https://tinyurl.com/stored' == bot.memory['rss']['shorturls'].get('http://www.site1.com/article1')
+
+
+def test_shorturlcache_lru(bot):
+    cache = rss.ShortUrlCache(bot, MockShortener(), 2)
+    cache.put({'a': 'x', 'b': 'y'})
+    cache.get('a')
+    cache.put({'c': 'z'})
+    assert ['a', 'c'] == list(cache.cache)
+
+
+def test_shorturlcache_fall_back_to_link(bot):
+    class FailingShortener:
+        def shorten(self, url):
+            raise rss.urllib.error.URLError('unreachable')
+    cache = rss.ShortUrlCache(bot, FailingShortener())
+    assert {'http://www.site1.com/article1': 'http://www.site1.com/article1'} == cache.shorten(['http://www.site1.com/article1'])
+    assert [] == bot.db.execute('SELECT * FROM rss_shorturls').fetchall()
+
+
+def test_shorturlcache_pause_after_failures(bot):
+    class HangingShortener:
+        calls = 0
+        def shorten(self, url):
+            HangingShortener.calls += 1
+            time.sleep(0.3)
+    cache = rss.ShortUrlCache(bot, HangingShortener())
+    for i in range(rss.SHORTURL_FAILURES):
+        cache.shorten(['http://www.site1.com/article{}'.format(i)], 0.05)
+    start = time.time()
+    assert {'http://www.site1.com/article9': 'http://www.site1.com/article9'} == cache.shorten(['http://www.site1.com/article9'], 0.05)
+    assert time.time() - start < 0.05
+    assert rss.SHORTURL_FAILURES == HangingShortener.calls
+    cache.paused = 0
+    cache.shorten(['http://www.site1.com/article9'], 0.05)
+    assert rss.SHORTURL_FAILURES + 1 == HangingShortener.calls
+    cache.shutdown()
+
+
+def test_shorturlcache_engine_deadline(bot, engine):
+    class SlowShortener(MockShortener):
+        async def shorten_async(self, url, engine):
+            await rss.asyncio.sleep(0.3)
+            return 'https://tinyurl.com/slow'
+    link = 'http://www.site1.com/article1'
+    cache = rss.ShortUrlCache(bot, SlowShortener(), engine=engine)
+    assert link == cache.shorten([link], 0.05)[link]
+    time.sleep(0.5)
+    assert None == cache.get(link)
+    assert 'https://tinyurl.com/slow' == cache.shorten([link], 0.05)[link]
+    assert {link: 'https://tinyurl.com/slow'} == rss._db_read_shorturls_from_database(bot, [link])
+
+
+def test_shorturlcache_deadline(bot):
+    class SlowShortener:
+        def shorten(self, url):
+            time.sleep(0.3)
+            return 'https://tinyurl.com/slow'
+    cache = rss.ShortUrlCache(bot, SlowShortener())
+    start = time.time()
+    shorturls = cache.shorten(['http://www.site1.com/article1'], 0.05)
+    assert time.time() - start < 0.25
+    assert 'http://www.site1.com/article1' == shorturls['http://www.site1.com/article1']
+    time.sleep(0.5)
+    assert 'https://tinyurl.com/slow' == cache.get('http://www.site1.com/article1')
+
+
+def test_feed_post_shortens_links_once(bot, feedreader_feed_valid):
+    class CountingShortener(MockShortener):
+        links = list()
+        def shorten(self, url):
+            CountingShortener.links.append(url)
+            return MockShortener.shorten(self, url)
+    bot.memory['rss']['shorturls'] = rss.ShortUrlCache(bot, CountingShortener())
+    rss._rss_formats(bot, ['format', 'feed1', 'f=t+ty'])
+    rss._feed_update(bot, feedreader_feed_valid, 'feed1', True)
+    rss._feed_update(bot, feedreader_feed_valid, 'feed1', True)
+    assert 3 == len(CountingShortener.links)
+    expected = 'Title 1 \x02→\x02 ' + MockShortener().shorten('http://www.site1.com/article1')
+    assert expected in bot.output
+
+
+def test_config_get_engine(bot):
+    assert None == rss._config_get_engine(bot)
+    bot.config.rss.update_engine = 'unknown'
+    assert None == rss._config_get_engine(bot)
+    bot.config.rss.update_engine = 'asyncio'
+    engine = rss._config_get_engine(bot)
+    assert isinstance(engine, rss.AsyncEngine)
+    engine.shutdown()
+
+
+def test_config_get_shortener(bot):
+    bot.config.rss.shortener = 'tinyurl'
+    assert isinstance(rss._config_get_shortener(bot), rss.TinyurlShortener)
+    bot.config.rss.shortener = 'mock'
+    assert isinstance(rss._config_get_shortener(bot), rss.TinyurlShortener)
+    bot.config.rss.shortener = 'unknown'
+    assert isinstance(rss._config_get_shortener(bot), rss.TinyurlShortener)